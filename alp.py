@@ -29,9 +29,109 @@ alp
 """
 
 import sys
+import os
+import socket
+
+######################################################################
+
+# Query client for a running Alp daemon. This is kept above the
+# remaining imports so that "alp --query" never loads curses, termcolor
+# or the formatting machinery.
+
+def _default_socket_path():
+    """Get the default path of the Alp daemon socket"""
+    directory = os.environ.get('XDG_RUNTIME_DIR') or \
+        os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, 'alp-%d.sock' % os.getuid())
+
+def query(date_format='datetime', socket_path=None, timeout=2.0):
+    """
+    Get the current rendering of date_format from a running Alp
+    daemon. date_format can be "datetime", "clock", "gregdatetime" (or
+    "1", "2" and "3") or an Alp date format. The text is returned
+    without formatting codes. socket.timeout is raised if the daemon
+    does not answer within timeout seconds.
+    """
+    if socket_path is None:
+        socket_path = _default_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(date_format)
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        sock.close()
+    status, sep, text = ''.join(chunks).partition('\n')
+    if status != 'ok':
+        raise ValueError(text or 'no reply from the Alp daemon')
+    return text
+
+def _query_command(date_format, socket_path=None):
+    try:
+        text = query(date_format, socket_path)
+    except socket.timeout:
+        sys.stderr.write('alp: the daemon on %s did not answer in time\n' %
+                         (socket_path or _default_socket_path()))
+        return 1
+    except socket.error:
+        sys.stderr.write('alp: no daemon is listening on %s\n' %
+                         (socket_path or _default_socket_path()))
+        return 1
+    except ValueError, e:
+        sys.stderr.write('alp: %s\n' % e)
+        return 1
+    sys.stdout.write(text + '\n')
+    return 0
+
+def _quick_query_args(args):
+    """
+    Get (date_format, socket_path) if args only contain --query and
+    --socket, or None if the full option parser is needed
+    """
+    values = {'--query': None, '--socket': None}
+    while args:
+        arg = args.pop(0)
+        if '=' in arg:
+            arg, val = arg.split('=', 1)
+        elif args:
+            val = args.pop(0)
+        else:
+            return None
+        if arg not in values:
+            return None
+        values[arg] = val
+    if values['--query'] is None:
+        return None
+    return values['--query'], values['--socket']
+
+if __name__ == '__main__':
+    _quick_args = _quick_query_args(sys.argv[1:])
+    if _quick_args is not None:
+        sys.exit(_query_command(*_quick_args))
+
+######################################################################
+
 from datetime import datetime, timedelta
 import re
 import time as time_module
+import select
+import errno
+import stat
+import mmap
+import struct
+import math
+import heapq
+import bisect
+import itertools
+import threading
+import traceback
 try:
     import curses
     _has_curses = True
@@ -76,6 +176,10 @@ _qvalp_divide = 2 ** 12
 _salp_divide = 2 ** 8
 _talp_divide = 2 ** 4
 
+# The units of AlpTime objects
+_time_units = ('seconds_since_epoch', 'seconds', 'alp', 'hexalp', 'qvalp',
+               'salp', 'talp', 'second')
+
 class AlpTime(object):
     """The Alp time object"""
     seconds_since_epoch=None
@@ -186,6 +290,21 @@ def alp_to_datetime(alp, hexalp, qvalp, salp, talp, second):
         date[4] * _talp_divide + date[5]
     return _epoch + timedelta(seconds=secs)
 
+def _parse_date_arg(text):
+    """
+    Get the datetime of a date given on the command line as
+    "GRE:year,month,day,hour,minute,second" or
+    "ALP:alp,hexalp,qvalp,salp,talp,second"
+    """
+    date = text.lower().split(':')
+    typ = date[0]
+    date = date[1].split(',')
+    if typ == 'alp':
+        return alp_to_datetime(*date)
+    elif typ == 'gre':
+        return datetime(*map(int, date))
+    raise ValueError('unknown date type "%s"' % typ)
+
 ######################################################################
 
 # Using curses without initscr
@@ -591,6 +710,7 @@ def print_time(date_format=None, greg_date_format=None,
         if use_formatting is None:
             use_formatting = True
     be_continous = continous or kwds.get('continous') or False
+    publisher = kwds.get('publisher')
 
     def _print_part():
         t = ''
@@ -626,6 +746,9 @@ def print_time(date_format=None, greg_date_format=None,
             print text,
         return
 
+    if publisher is not None:
+        publisher.publish()
+
     go_up = 0
     try:
         while True:
@@ -633,6 +756,8 @@ def print_time(date_format=None, greg_date_format=None,
             now = time.seconds_since_epoch
             if now > prev:
                 prev = now
+                if publisher is not None:
+                    publisher.publish()
                 if _using_curses:
                     text = '!(up)' * go_up + '!(up)\n' + \
                         _print_part() + '!(up)!(down)'
@@ -654,6 +779,1130 @@ def print_time(date_format=None, greg_date_format=None,
 
 ######################################################################
 
+# Daemon mode
+
+_daemon_named_formats = {
+    '1': 'datetime', '2': 'clock', '3': 'gregdatetime',
+    'datetime': 'datetime', 'clock': 'clock', 'gregdatetime': 'gregdatetime'
+}
+_daemon_max_formats = 64
+_daemon_request_timeout = 0.2
+
+def _check_date_format(date_format):
+    """Raise ValueError if date_format cannot be rendered"""
+    for part in _get_date_format_plan(date_format):
+        if not isinstance(part, tuple):
+            continue
+        unit, kind, zeroes = part
+        if unit not in _time_units:
+            raise ValueError('unknown unit %s' % unit)
+        if kind == 'zero' and not zeroes[2:-1].isdigit():
+            raise ValueError('invalid number of digits in %s' % unit)
+
+def _get_plain_text(date_format):
+    name = _daemon_named_formats.get(date_format)
+    if name == 'datetime':
+        text = get_date_text()
+    elif name == 'clock':
+        update_clock()
+        text = get_clock_text()
+    elif name == 'gregdatetime':
+        text = get_gregorian_date_text()
+    else:
+        text = get_date_text(date_format)
+    return unformat(text)
+
+def _answer_query(date_format, rendered, formats):
+    """
+    Get the reply to a query, rendering and remembering date_format if
+    it is new
+    """
+    date_format = _daemon_named_formats.get(date_format, date_format)
+    if date_format not in rendered:
+        try:
+            if date_format not in _daemon_named_formats:
+                _check_date_format(date_format)
+            rendered[date_format] = _get_plain_text(date_format)
+        except (KeyError, ValueError, TypeError), e:
+            return 'error\n%s' % e
+        formats.append(date_format)
+        if len(formats) > _daemon_max_formats:
+            del formats[3]
+    return 'ok\n' + rendered[date_format]
+
+def _time_to_next_second():
+    """Get the number of real seconds until the next Alp second"""
+    diff = time.get_seconds_since_epoch()[1]
+    left = 1 - diff.microseconds / 1000000.0
+    return max(left / time.speed, 0.001)
+
+def serve(socket_path=None, publisher=None):
+    """
+    Run an Alp daemon, answering queries (see the query function) on
+    a Unix socket. Every known format is rendered once per Alp second,
+    so a query costs no more than a socket round trip. If publisher
+    is a TickPublisher, every Alp second is also published with it.
+    """
+    if socket_path is None:
+        socket_path = _default_socket_path()
+    if os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise socket.error('%s exists and is not a socket' % socket_path)
+        try:
+            query('datetime', socket_path)
+        except (socket.error, ValueError):
+            os.unlink(socket_path)
+        else:
+            raise socket.error('an Alp daemon is already listening on %s'
+                               % socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(16)
+
+    formats = ['datetime', 'clock', 'gregdatetime']
+    rendered = {}
+    # Connections still sending their format: {conn: [chunks, deadline]}
+    pending = {}
+    prev = None
+    try:
+        while True:
+            update()
+            if time.seconds_since_epoch != prev:
+                prev = time.seconds_since_epoch
+                if publisher is not None:
+                    publisher.publish()
+                update_clock()
+                rendered = {}
+                for x in formats:
+                    rendered[x] = _get_plain_text(x)
+
+            now = time_module.time()
+            for conn in pending.keys():
+                if pending[conn][1] <= now:
+                    del pending[conn]
+                    conn.close()
+            timeout = _time_to_next_second()
+            for chunks, deadline in pending.values():
+                timeout = min(timeout, max(deadline - now, 0))
+            readable = select.select([server] + pending.keys(), [], [],
+                                     timeout)[0]
+
+            for conn in readable:
+                if conn is server:
+                    try:
+                        conn = server.accept()[0]
+                    except socket.error:
+                        continue
+                    conn.setblocking(0)
+                    pending[conn] = [[], time_module.time() +
+                                     _daemon_request_timeout]
+                    continue
+                try:
+                    data = conn.recv(4096)
+                except socket.error:
+                    data = None
+                if data:
+                    pending[conn][0].append(data)
+                    if sum([len(x) for x in pending[conn][0]]) <= 4096:
+                        continue
+                    data = None
+                chunks = pending.pop(conn)[0]
+                try:
+                    if data is not None:
+                        conn.sendall(_answer_query(
+                                ''.join(chunks), rendered, formats))
+                except socket.error:
+                    pass
+                except Exception:
+                    traceback.print_exc()
+                conn.close()
+    finally:
+        for conn in pending:
+            conn.close()
+        server.close()
+        os.unlink(socket_path)
+
+######################################################################
+
+# Shared-memory ticks
+
+## A tick file holds a header (magic and version), a sequence number
+ # and the tick. The sequence number is 0 before the first tick and
+ # odd while a tick is being written, so readers retry until they have
+ # read the same even number before and after the tick.
+_tick_magic = 'ALPT'
+_tick_version = 1
+_tick_header_struct = struct.Struct('<4sB3x')
+_tick_text_size = 64
+_tick_seq_struct = struct.Struct('<Q')
+_tick_struct = struct.Struct('<8qH%ds' % _tick_text_size)
+_tick_seq_offset = _tick_header_struct.size
+_tick_offset = _tick_seq_offset + _tick_seq_struct.size
+_tick_file_size = _tick_offset + _tick_struct.size
+
+def _open_tick_file(path, flags, access):
+    """Map a tick file, or raise IOError if it is not one"""
+    fd = os.open(path, flags)
+    try:
+        if os.fstat(fd).st_size == _tick_file_size:
+            tick_map = mmap.mmap(fd, _tick_file_size, access=access)
+            if _tick_header_struct.unpack_from(tick_map, 0) == \
+                    (_tick_magic, _tick_version):
+                return tick_map
+            tick_map.close()
+    finally:
+        os.close(fd)
+    raise IOError('%s is not an Alp tick file' % path)
+
+class TickPublisher(object):
+    """
+    A publisher of the Alp time in a memory-mapped file. The file is
+    created if it does not exist, and existing files are only reused if
+    they are tick files.
+    """
+
+    def __init__(self, path):
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0644)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            self.map = _open_tick_file(path, os.O_RDWR, mmap.ACCESS_WRITE)
+        else:
+            try:
+                os.write(fd, _tick_header_struct.pack(
+                        _tick_magic, _tick_version) +
+                         '\0' * (_tick_file_size - _tick_header_struct.size))
+                self.map = mmap.mmap(fd, _tick_file_size)
+            finally:
+                os.close(fd)
+        self.seq = _tick_seq_struct.unpack_from(
+            self.map, _tick_seq_offset)[0]
+        self.seq += self.seq & 1
+
+    def publish(self):
+        """
+        Publish the internal time, including the Alp date in the
+        default date format without formatting codes
+        """
+        text = unformat(get_date_text())[:_tick_text_size]
+        values = [getattr(time, x) for x in _time_units]
+        values.extend((len(text), text))
+        self.seq += 1
+        _tick_seq_struct.pack_into(self.map, _tick_seq_offset, self.seq)
+        _tick_struct.pack_into(self.map, _tick_offset, *values)
+        self.seq += 1
+        _tick_seq_struct.pack_into(self.map, _tick_seq_offset, self.seq)
+
+    def close(self):
+        """Close the tick file"""
+        self.map.close()
+
+class TickReader(object):
+    """A reader of the Alp time published by a TickPublisher"""
+
+    def __init__(self, path, retries=10000):
+        self.map = _open_tick_file(path, os.O_RDONLY, mmap.ACCESS_READ)
+        self.retries = retries
+
+    def read(self):
+        """
+        Get the latest tick as a dictionary of the AlpTime units and
+        "text", or None if nothing has been published yet
+        """
+        for i in xrange(self.retries):
+            seq = _tick_seq_struct.unpack_from(self.map,
+                                               _tick_seq_offset)[0]
+            if seq & 1:
+                continue
+            values = _tick_struct.unpack_from(self.map, _tick_offset)
+            if _tick_seq_struct.unpack_from(self.map,
+                                            _tick_seq_offset)[0] != seq:
+                continue
+            if seq == 0:
+                return None
+            tick = dict(zip(_time_units, values))
+            tick['text'] = values[-1][:values[-2]]
+            return tick
+        raise IOError('the tick file is not being written consistently')
+
+    def close(self):
+        """Close the tick file"""
+        self.map.close()
+
+######################################################################
+
+# Scheduling callbacks at Alp times
+
+_unit_sizes = {
+    'alp': _one_alp, 'hexalp': _hexalp_divide, 'qvalp': _qvalp_divide,
+    'salp': _salp_divide, 'talp': _talp_divide, 'second': 1
+}
+
+def _get_seconds_from_datetime(date):
+    diff = date - _epoch
+    return diff.days * 86400 + diff.seconds
+
+class AlpTimer(object):
+    """A callback scheduled by an AlpScheduler"""
+
+    def __init__(self, due, interval, callback, args, kwds):
+        self.due = due
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.kwds = kwds
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop the timer from running again"""
+        self.cancelled = True
+
+class AlpScheduler(object):
+    """
+    A scheduler running callbacks at Alp unit boundaries or at given
+    Alp times. All timers are kept in one heap, so adding and running a
+    timer costs O(log n). Timers can be driven by one thread (see the
+    start method) or by calling run_pending from an existing loop.
+    """
+
+    def __init__(self, alp_time=None):
+        self.time = alp_time or time
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def _now(self):
+        passed, diff = self.time.get_seconds_since_epoch()
+        return passed + diff.microseconds / 1000000.0
+
+    def _add(self, timer):
+        self._condition.acquire()
+        try:
+            heapq.heappush(self._heap,
+                           (timer.due, self._counter.next(), timer))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        return timer
+
+    def every(self, unit, callback, *args, **kwds):
+        """
+        Call callback(*args, **kwds) at the start of every unit, where
+        unit is "alp", "hexalp", "qvalp", "salp", "talp" or "second"
+        """
+        size = _unit_sizes[unit]
+        due = (int(math.floor(self._now())) / size + 1) * size
+        return self._add(AlpTimer(due, size, callback, args, kwds))
+
+    def at(self, date, callback, *args, **kwds):
+        """
+        Call callback(*args, **kwds) once at date, which is either a
+        datetime object or a sequence of Alp units as accepted by
+        alp_to_datetime
+        """
+        if not isinstance(date, datetime):
+            date = alp_to_datetime(*date)
+        due = _get_seconds_from_datetime(date)
+        return self._add(AlpTimer(due, None, callback, args, kwds))
+
+    def run_pending(self):
+        """
+        Run the timers that are due, and get the number of Alp seconds
+        until the next timer (or None if there are no timers)
+        """
+        now = self._now()
+        while True:
+            self._condition.acquire()
+            try:
+                if not self._heap:
+                    return None
+                if self._heap[0][0] > now:
+                    return self._heap[0][0] - now
+                timer = heapq.heappop(self._heap)[2]
+                if timer.cancelled:
+                    continue
+                if timer.interval is not None:
+                    timer.due += timer.interval
+                    if timer.due <= now:
+                        timer.due = timer.interval * \
+                            (int(math.floor(now)) / timer.interval + 1)
+                    heapq.heappush(self._heap,
+                                   (timer.due, self._counter.next(), timer))
+            finally:
+                self._condition.release()
+            timer.callback(*timer.args, **timer.kwds)
+
+    def _run(self):
+        while self._running:
+            try:
+                wait = self.run_pending()
+            except Exception:
+                traceback.print_exc()
+                continue
+            self._condition.acquire()
+            try:
+                if not self._running:
+                    break
+                if wait is None:
+                    self._condition.wait()
+                else:
+                    self._condition.wait(wait / float(self.time.speed))
+            finally:
+                self._condition.release()
+
+    def start(self):
+        """Start a thread running the timers"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread running the timers"""
+        if self._thread is None:
+            return
+        self._condition.acquire()
+        try:
+            self._running = False
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        self._thread.join()
+        self._thread = None
+
+######################################################################
+
+# Walls of many clocks
+
+## Date formats are compiled into plans of literal text and
+ # (unit, kind, zeroes) parts. Clock layouts are compiled into a '%s'
+ # template with the letter of every '%s', and the lamps of every
+ # letter are generated only once for each state.
+_compiled_date_formats = {}
+_compiled_clock_layouts = {}
+_lamp_fragments = {}
+
+def _compile_date_format(date_format):
+    try:
+        return _compiled_date_formats[date_format]
+    except KeyError:
+        pass
+    plan = _get_date_format_plan(date_format)
+    _compiled_date_formats[date_format] = plan
+    return plan
+
+def _get_date_format_plan(date_format):
+    plan = []
+    pos = 0
+    for obj in _date_format_unit_regex.finditer(date_format):
+        plan.append(date_format[pos:obj.start()])
+        pos = obj.end()
+        unit = obj.groups(1)[0]
+        if '_' in unit:
+            spl = unit.split('_')
+            plan.append((spl[0], 'zero', '%0' + spl[1] + 'd'))
+        elif unit.endswith('#'):
+            plan.append((unit[:-1], 'hex', None))
+        else:
+            plan.append((unit, 'str', None))
+    plan.append(date_format[pos:])
+    return plan
+
+def _get_compiled_date_text(plan, alp_time):
+    values = alp_time.__dict__
+    parts = []
+    for part in plan:
+        if not isinstance(part, tuple):
+            parts.append(part)
+            continue
+        unit, kind, zeroes = part
+        value = values[unit]
+        if kind == 'zero':
+            parts.append(zeroes % value)
+        elif kind == 'hex':
+            parts.append(hex(value)[2:].upper())
+        else:
+            parts.append(str(value))
+    return ''.join(parts)
+
+def _get_second_lamps(second):
+    """Get the o-s lamps of a second as a 5-bit number (o is bit 0)"""
+    q0, q1, q2, q3 = [(second >> i) & 1 for i in range(4)]
+    o = q0 | q1
+    p = q2 ^ q3
+    r = (q2 | q3) ^ 1
+    val_e = ((q0 ^ 1) & q1 & p) | (q0 & ((q2 & q3) | ((q1 | q2 | q3) ^ 1)))
+    val_d = q1 & (((q0 ^ 1) & (p ^ 1)) | (q0 & (((q2 ^ 1) & q3) | q2)))
+    val_c = (q3 & (q2 | (o ^ 1))) | (q0 & q1 & r)
+    val_b = ((o ^ 1) & q2 & (q3 ^ 1)) | (q3 & (o | q2))
+    val_a = q3 | (q2 & o)
+    return val_e | val_d << 1 | val_c << 2 | val_b << 3 | val_a << 4
+
+_second_lamps = [_get_second_lamps(x) for x in range(16)]
+
+def _get_clock_mask(alp_time):
+    """
+    Get the lamps of a clock as a number where bit i is the state of
+    the letter _clock_letters[i]
+    """
+    return alp_time.hexalp | alp_time.qvalp << 4 | alp_time.salp << 6 | \
+        alp_time.talp << 10 | _second_lamps[alp_time.second] << 14
+
+def _get_lamp_fragment(letter, state):
+    try:
+        return _lamp_fragments[letter, state]
+    except KeyError:
+        pass
+    lamp = _clock_formatting.get(letter, _clock_formatting['*'])
+    text = lamp.generate(state) + _default_clock_controls
+    _lamp_fragments[letter, state] = text
+    return text
+
+def _compile_clock_layout(clock_layout):
+    try:
+        return _compiled_clock_layouts[clock_layout]
+    except KeyError:
+        pass
+    letters = []
+    def _replace(obj):
+        letters.append(_clock_letters.index(obj.group(1)))
+        return '%s'
+    template = re.sub(r'([' + _clock_letters + '])', _replace,
+                      clock_layout.replace('%', '%%'))
+    template = _default_clock_controls + template.replace(
+        '\n', '!(normal)\n' + _default_clock_controls) + '!(normal)'
+    fragments = [(_get_lamp_fragment(_clock_letters[i], False),
+                  _get_lamp_fragment(_clock_letters[i], True))
+                 for i in letters]
+    plan = template, letters, fragments
+    _compiled_clock_layouts[clock_layout] = plan
+    return plan
+
+def _get_compiled_clock_text(plan, alp_time):
+    template, letters, fragments = plan
+    mask = _get_clock_mask(alp_time)
+    return template % tuple([fragments[i][(mask >> letters[i]) & 1]
+                             for i in range(len(letters))])
+
+class ClockWall(object):
+    """
+    A grid of Alp clocks, each with its own start date and speed. The
+    configurations are dictionaries with the optional keys "start_date"
+    (a datetime), "speed" and "label".
+    """
+
+    def __init__(self, configs, show=None, date_format=None,
+                 greg_date_format=None, clock_layout=None, columns=4):
+        self.show = show or ['datetime']
+        self.date_plan = _compile_date_format(
+            date_format or _default_hex_date_format)
+        self.greg_date_format = greg_date_format or \
+            _default_gregorian_date_format
+        self.clock_plan = _compile_clock_layout(
+            clock_layout or _default_clock_layout)
+        if columns < 1:
+            raise ValueError('a wall needs at least one column')
+        self.columns = columns
+        self.clocks = []
+        self.labels = []
+        for config in configs:
+            alp_time = AlpTime()
+            alp_time.set_speed(config.get('speed', 1))
+            alp_time.set_start_date(config.get('start_date'))
+            self.clocks.append(alp_time)
+            self.labels.append(config.get('label'))
+
+    def update(self):
+        """
+        Update the time of all clocks, and get whether any of them
+        has reached a new second
+        """
+        changed = False
+        for alp_time in self.clocks:
+            prev = alp_time.seconds_since_epoch
+            alp_time.update()
+            if alp_time.seconds_since_epoch != prev:
+                changed = True
+        return changed
+
+    def _get_cell(self, alp_time, label):
+        parts = []
+        if label is not None:
+            parts.append('!(bold)' + label + '!(normal)')
+        for x in self.show:
+            if x == 'datetime':
+                parts.append(_get_compiled_date_text(
+                        self.date_plan, alp_time) + '!(normal)')
+            elif x == 'gregdatetime':
+                parts.append(alp_time.real_date.strftime(
+                        self.greg_date_format) + '!(normal)')
+            elif x == 'clock':
+                parts.append(_get_compiled_clock_text(
+                        self.clock_plan, alp_time))
+        lines = '\n'.join(parts).replace('\n', '!(normal)\n').split('\n')
+        return [(line, _textlen(line)) for line in lines]
+
+    def get_text(self):
+        """Get the wall with formatting codes, without updating it"""
+        cells = [self._get_cell(alp_time, label) for alp_time, label
+                 in zip(self.clocks, self.labels)]
+        if not cells:
+            return ''
+        width = max([w for cell in cells for line, w in cell])
+        rows = []
+        for i in range(0, len(cells), self.columns):
+            row = cells[i:i + self.columns]
+            height = max([len(cell) for cell in row])
+            for j in range(height):
+                line = []
+                for cell in row:
+                    if j < len(cell):
+                        text, w = cell[j]
+                    else:
+                        text, w = '', 0
+                    line.append(text + ' ' * (width - w))
+                rows.append('  '.join(line).rstrip())
+            rows.append('')
+        return '\n'.join(rows[:-1])
+
+def print_wall(wall, formatting=True, continous=False):
+    """
+    Print a ClockWall. Every frame is generated and written in one
+    pass.
+    """
+    start_formatter()
+    formatter.generate('!(hide_cursor)', True)
+
+    def _get_frame():
+        text = wall.get_text() + '!(normal)'
+        if not formatting:
+            text = unformat(text, False)
+        return text
+
+    wall.update()
+    if not continous:
+        text = formatter.generate(_get_frame())
+        if _using_curses:
+            print text
+        else:
+            print text,
+        return
+
+    speed = max([abs(x.speed) for x in wall.clocks] + [1])
+    go_up = 0
+    try:
+        while True:
+            if wall.update() or go_up == 0:
+                if _using_curses:
+                    text = '!(up)' * go_up + '!(up)\n' + \
+                        _get_frame() + '!(up)!(down)'
+                else:
+                    text = _get_frame() + '\n\n'
+                go_up = text.count('\n') - 1
+                sys.stdout.write(formatter.generate(text))
+                sys.stdout.flush()
+
+            sleep_time = 0.5 / speed
+            if sleep_time < 0.01:
+                sleep_time = 0.01
+            time_module.sleep(sleep_time)
+    except KeyboardInterrupt:
+        formatter.generate('\n!(up)' + '!(clear_line)!(up)' * go_up, True)
+        raise KeyboardInterrupt()
+
+######################################################################
+
+# Compact binary timestamp files
+
+## A timestamp file starts with a header (magic and version) followed by
+ # blocks of seconds since epoch. Each block header holds the number of
+ # timestamps, the payload length, the first timestamp and the lowest
+ # and highest timestamps of the block, so readers can skip blocks
+ # outside the range they need. The payload holds the differences
+ # between the following timestamps as zigzag-encoded varints.
+_stamp_magic = 'ALPS'
+_stamp_version = 1
+_stamp_header_struct = struct.Struct('<4sB')
+_stamp_block_struct = struct.Struct('<IIqqq')
+
+## (unit, divisor, modulus) of the units split_seconds returns
+_split_units = (
+    ('seconds', 1, _one_alp),
+    ('alp', _one_alp, None),
+    ('hexalp', _hexalp_divide, _one_alp / _hexalp_divide),
+    ('qvalp', _qvalp_divide, _hexalp_divide / _qvalp_divide),
+    ('salp', _salp_divide, _qvalp_divide / _salp_divide),
+    ('talp', _talp_divide, _salp_divide / _talp_divide),
+    ('second', 1, _talp_divide)
+)
+
+def _get_unit_column(values, divisor, modulus):
+    if modulus is None:
+        return [x / divisor for x in values]
+    if divisor == 1:
+        return [x % modulus for x in values]
+    return [x / divisor % modulus for x in values]
+
+def _get_unit_columns(values):
+    """
+    Get a dictionary of lists, one for each unit of split_seconds, of
+    a list of numbers of seconds since epoch
+    """
+    columns = {}
+    for unit, divisor, modulus in _split_units:
+        columns[unit] = _get_unit_column(values, divisor, modulus)
+    return columns
+
+def split_seconds(seconds):
+    """
+    Get the (seconds, alp, hexalp, qvalp, salp, talp, second) units of
+    a number of seconds since epoch
+    """
+    return tuple([_get_unit_column((seconds,), divisor, modulus)[0]
+                  for unit, divisor, modulus in _split_units])
+
+def _get_seconds(date):
+    if isinstance(date, datetime):
+        return _get_seconds_from_datetime(date)
+    return date
+
+def _encode_varints(values):
+    data = []
+    for x in values:
+        if x < 0:
+            x = (-x << 1) - 1
+        else:
+            x <<= 1
+        while x > 0x7f:
+            data.append(chr(0x80 | (x & 0x7f)))
+            x >>= 7
+        data.append(chr(x))
+    return ''.join(data)
+
+def _decode_varints(data, first, count):
+    values = [first]
+    prev = first
+    x = 0
+    shift = 0
+    for c in data:
+        c = ord(c)
+        x |= (c & 0x7f) << shift
+        if c & 0x80:
+            shift += 7
+            continue
+        prev += (x >> 1) ^ -(x & 1)
+        values.append(prev)
+        x = 0
+        shift = 0
+    if len(values) != count:
+        raise IOError('corrupt timestamp block')
+    return values
+
+class AlpStampWriter(object):
+    """
+    A streaming writer of timestamps (in seconds since epoch) to a
+    compact binary file. fileobj can be a file object or a path.
+    """
+
+    def __init__(self, fileobj, block_size=4096):
+        if isinstance(fileobj, basestring):
+            fileobj = open(fileobj, 'wb')
+        self.file = fileobj
+        self.block_size = block_size
+        self.values = []
+        self.file.write(_stamp_header_struct.pack(_stamp_magic,
+                                                  _stamp_version))
+
+    def write(self, seconds):
+        """Write a timestamp in seconds since epoch"""
+        self.values.append(seconds)
+        if len(self.values) >= self.block_size:
+            self._write_block()
+
+    def write_datetime(self, date):
+        """Write a timestamp given as a datetime object"""
+        self.write(_get_seconds_from_datetime(date))
+
+    def _write_block(self):
+        values = self.values
+        if not values:
+            return
+        data = _encode_varints([values[i] - values[i - 1]
+                                for i in xrange(1, len(values))])
+        self.file.write(_stamp_block_struct.pack(
+                len(values), len(data), values[0], min(values), max(values)))
+        self.file.write(data)
+        self.values = []
+
+    def flush(self):
+        """Write the current block, and flush the file"""
+        self._write_block()
+        self.file.flush()
+
+    def close(self):
+        """Write the current block, and close the file"""
+        self._write_block()
+        self.file.close()
+
+class AlpStampReader(object):
+    """
+    A memory-mapped reader of files written by AlpStampWriter. Ranges
+    are given as start (inclusive) and end (exclusive), in seconds since
+    epoch or as datetime objects.
+    """
+
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < _stamp_header_struct.size:
+                raise IOError('%s is not an Alp timestamp file' % path)
+            self.map = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, file_version = _stamp_header_struct.unpack_from(self.map, 0)
+        if magic != _stamp_magic or file_version != _stamp_version:
+            self.map.close()
+            raise IOError('%s is not an Alp timestamp file' % path)
+
+        # (payload offset, count, length, first, lowest, highest)
+        self.blocks = []
+        pos = _stamp_header_struct.size
+        while pos + _stamp_block_struct.size <= size:
+            info = _stamp_block_struct.unpack_from(self.map, pos)
+            pos += _stamp_block_struct.size
+            self.blocks.append((pos,) + info)
+            pos += info[1]
+
+        # Blocks of sorted files can be found by binary search
+        self.highest = [x[5] for x in self.blocks]
+        self.sorted = True
+        for i in xrange(1, len(self.blocks)):
+            if self.blocks[i][4] < self.blocks[i - 1][5]:
+                self.sorted = False
+                break
+
+    def __len__(self):
+        return sum([x[1] for x in self.blocks])
+
+    def _get_blocks(self, start, end):
+        if not self.sorted:
+            for block in self.blocks:
+                if start is not None and block[5] < start:
+                    continue
+                if end is not None and block[4] >= end:
+                    continue
+                yield block
+            return
+
+        i = 0
+        if start is not None:
+            i = bisect.bisect_left(self.highest, start)
+        for block in self.blocks[i:]:
+            if end is not None and block[4] >= end:
+                break
+            yield block
+
+    def _decode_block(self, block):
+        pos, count, length, first = block[:4]
+        return _decode_varints(self.map[pos:pos + length], first, count)
+
+    def iter_seconds(self, start=None, end=None):
+        """Iterate over the timestamps in a range, in seconds since epoch"""
+        start = _get_seconds(start)
+        end = _get_seconds(end)
+        for block in self._get_blocks(start, end):
+            values = self._decode_block(block)
+            if (start is None or block[4] >= start) and \
+                    (end is None or block[5] < end):
+                for x in values:
+                    yield x
+                continue
+            for x in values:
+                if (start is None or x >= start) and \
+                        (end is None or x < end):
+                    yield x
+
+    def seconds(self, start=None, end=None):
+        """Get the timestamps in a range, in seconds since epoch"""
+        return list(self.iter_seconds(start, end))
+
+    def datetimes(self, start=None, end=None):
+        """Get the timestamps in a range as datetime objects"""
+        return [_epoch + timedelta(seconds=x)
+                for x in self.iter_seconds(start, end)]
+
+    def columns(self, start=None, end=None):
+        """
+        Get the timestamps in a range as a dictionary of lists, one for
+        each AlpTime unit (including seconds_since_epoch)
+        """
+        values = self.seconds(start, end)
+        columns = _get_unit_columns(values)
+        columns['seconds_since_epoch'] = values
+        return columns
+
+    def close(self):
+        """Close the file"""
+        self.map.close()
+
+######################################################################
+
+# Searching sorted timestamp files
+
+## Lines of sorted text files must start with either a Gregorian
+ # timestamp ("2010-10-15 12:00:00" or "2010-10-15T12:00:00") or an Alp
+ # date in the plain default date format ("ALP0000/00000"). Both sort
+ # as text, so a range is found by comparing the start of lines with
+ # the bounds converted to the same format once. Lines without a
+ # timestamp belong to the line before them.
+_search_key_formats = {
+    'gre': (re.compile(r'\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d'), 19),
+    'alp': (re.compile(r'ALP\d{4}/[0-9A-F]{5}'), 13)
+}
+_search_index_magic = 'ALPI'
+_search_index_header_struct = struct.Struct('<4s3sqq')
+_search_index_entry_struct = struct.Struct('<19sQ')
+
+def alp_range(alp, hexalp=None, qvalp=None, salp=None, talp=None,
+              second=None):
+    """
+    Get the (start, end) datetime objects of the given Alp units, e.g.
+    alp_range(2403, 9) for hexalp 9 of alp 2403. The units are given
+    as accepted by alp_to_datetime, and end is exclusive.
+    """
+    units = [alp, hexalp, qvalp, salp, talp, second]
+    names = ('alp', 'hexalp', 'qvalp', 'salp', 'talp', 'second')
+    given = 1
+    while given < len(units) and units[given] is not None:
+        value = units[given]
+        if isinstance(value, basestring):
+            value = int(value, 16)
+        limit = _unit_sizes[names[given - 1]] / _unit_sizes[names[given]]
+        if not 0 <= value < limit:
+            raise ValueError('%s must be from 0 to %X' %
+                             (names[given], limit - 1))
+        given += 1
+    last = units[given - 1]
+    if isinstance(last, basestring):
+        fill = '0'
+    else:
+        fill = 0
+    units[given:] = [fill] * (len(units) - given)
+    start = alp_to_datetime(*units)
+    return start, start + timedelta(seconds=_unit_sizes[names[given - 1]])
+
+def _get_search_key(date, key_format):
+    if key_format == 'gre':
+        return '%04d-%02d-%02d %02d:%02d:%02d' % (
+            date.year, date.month, date.day,
+            date.hour, date.minute, date.second)
+    units = split_seconds(_get_seconds_from_datetime(date))
+    if units[1] < 0:
+        return 'ALP'
+    if units[1] > 9999:
+        return 'ALQ'
+    return 'ALP%04d/%X%X%X%X%X' % units[1:]
+
+class AlpLogSearcher(object):
+    """
+    A memory-mapped binary search of a sorted text file of timestamped
+    lines. If a sidecar index made by build_index exists and is up to
+    date, it is used to narrow down searches.
+    """
+
+    def __init__(self, path, key_format=None, use_index=True):
+        self.path = path
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            stat = os.fstat(fd)
+            self.size = stat.st_size
+            self.mtime = int(stat.st_mtime)
+            self.map = None
+            if self.size:
+                self.map = mmap.mmap(fd, self.size,
+                                     access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self.key_format = key_format or self._detect_key_format()
+        self.regex, self.key_len = _search_key_formats[self.key_format]
+        self.index_keys = []
+        self.index_offsets = []
+        if use_index:
+            self._load_index()
+
+    def _detect_key_format(self):
+        if self.map is not None:
+            end = self.map.find('\n')
+            if end == -1:
+                end = self.size
+            line = self.map[:end]
+            for key_format, (regex, key_len) in \
+                    _search_key_formats.iteritems():
+                if regex.match(line):
+                    return key_format
+        return 'gre'
+
+    def _get_line_start(self, pos):
+        if pos <= 0:
+            return 0
+        end = self.map.find('\n', pos - 1)
+        if end == -1:
+            return self.size
+        return end + 1
+
+    def _get_keyed_line(self, pos):
+        """
+        Get (key, start, end) of the first timestamped line starting at
+        or after the line start pos, or None
+        """
+        while pos < self.size:
+            end = self.map.find('\n', pos)
+            if end == -1:
+                end = self.size
+            else:
+                end += 1
+            key = self.map[pos:pos + self.key_len]
+            if self.regex.match(key):
+                return key.replace('T', ' '), pos, end
+            pos = end
+        return None
+
+    def _find(self, key):
+        """Get the start of the first timestamped line not before key"""
+        lo, hi = 0, self.size
+        if self.index_keys:
+            i = bisect.bisect_left(self.index_keys, key)
+            if i > 0:
+                lo = self.index_offsets[i - 1]
+            if i < len(self.index_keys):
+                hi = self.index_offsets[i]
+        while lo < hi:
+            mid = (lo + hi) / 2
+            line = self._get_keyed_line(self._get_line_start(mid))
+            if line is not None and line[0] < key:
+                lo = line[2]
+            else:
+                hi = mid
+        line = self._get_keyed_line(self._get_line_start(lo))
+        if line is None:
+            return self.size
+        return line[1]
+
+    def find_range(self, start, end):
+        """
+        Get the (begin, end) byte offsets of the lines from the datetime
+        start (inclusive) to the datetime end (exclusive)
+        """
+        if self.map is None:
+            return 0, 0
+        begin = self._find(_get_search_key(start, self.key_format))
+        return begin, max(begin, self._find(
+                _get_search_key(end, self.key_format)))
+
+    def lines(self, start, end):
+        """Iterate over the lines from start to end (see find_range)"""
+        pos, end = self.find_range(start, end)
+        while pos < end:
+            line_end = self.map.find('\n', pos, end)
+            if line_end == -1:
+                line_end = end
+            else:
+                line_end += 1
+            yield self.map[pos:line_end]
+            pos = line_end
+
+    def _load_index(self):
+        try:
+            index = open(self.path + '.alpidx', 'rb')
+        except IOError:
+            return
+        try:
+            data = index.read()
+        finally:
+            index.close()
+        header_size = _search_index_header_struct.size
+        if len(data) < header_size:
+            return
+        magic, key_format, size, mtime = \
+            _search_index_header_struct.unpack_from(data, 0)
+        if magic != _search_index_magic or \
+                key_format.rstrip('\0') != self.key_format or \
+                size != self.size or mtime != self.mtime:
+            return
+        entry_size = _search_index_entry_struct.size
+        for pos in xrange(header_size, len(data) - entry_size + 1,
+                          entry_size):
+            key, offset = _search_index_entry_struct.unpack_from(data, pos)
+            self.index_keys.append(key.rstrip('\0'))
+            self.index_offsets.append(offset)
+
+    def build_index(self, step=2 ** 20):
+        """
+        Write a sparse sidecar index (the path with ".alpidx" appended)
+        with the first timestamp after every step bytes
+        """
+        entries = []
+        prev = None
+        for pos in xrange(0, self.size, step):
+            line = self._get_keyed_line(self._get_line_start(pos))
+            if line is None:
+                break
+            if line[1] != prev:
+                entries.append(_search_index_entry_struct.pack(
+                        line[0], line[1]))
+                prev = line[1]
+        index = open(self.path + '.alpidx', 'wb')
+        try:
+            index.write(_search_index_header_struct.pack(
+                    _search_index_magic, self.key_format,
+                    self.size, self.mtime))
+            index.write(''.join(entries))
+        finally:
+            index.close()
+        self.index_keys = []
+        self.index_offsets = []
+        self._load_index()
+
+    def close(self):
+        """Close the file"""
+        if self.map is not None:
+            self.map.close()
+
+def search(path, start, end):
+    """
+    Iterate over the timestamps of a sorted file from the datetime
+    start (inclusive) to the datetime end (exclusive). For files written
+    by AlpStampWriter, the timestamps are datetime objects. For text
+    files (see AlpLogSearcher), they are lines.
+    """
+    header = open(path, 'rb')
+    try:
+        magic = header.read(len(_stamp_magic))
+    finally:
+        header.close()
+    if magic == _stamp_magic:
+        reader = AlpStampReader(path)
+        try:
+            for x in reader.iter_seconds(start, end):
+                yield _epoch + timedelta(seconds=x)
+        finally:
+            reader.close()
+    else:
+        searcher = AlpLogSearcher(path)
+        try:
+            for x in searcher.lines(start, end):
+                yield x
+        finally:
+            searcher.close()
+
+######################################################################
+
 if __name__ == '__main__':
     from optparse import OptionParser
     class XParser(OptionParser):
@@ -688,6 +1937,16 @@ Examples:
   Continously show a clock with no formatting:
     alp -c -F -s clock
 
+  Show a wall of two clocks, one of them going 60 times faster:
+    alp --wall now --wall GRE:2010,10,15,12,0,0@60 -s all
+
+  Print the lines of a sorted log from hexalp 9 of alp 2403:
+    alp --search server.log ALP:2403,9
+
+  Start a daemon, and print the Alp time from it in a status bar:
+    alp --daemon &
+    alp --query datetime
+
 ''')
     parser.add_option('-s', '--show', dest='show', metavar='TYPE', action='append',
                       help='choose which types of displays to show. You \
@@ -706,6 +1965,36 @@ colors and making the text bold)')
     parser.add_option('--no-curses', dest='use_curses',
                       action='store_false', default=True,
                       help='do not attempt to use the curses library')
+    parser.add_option('--daemon', dest='daemon',
+                      action='store_true', default=False,
+                      help='run as a daemon, answering queries from \
+"alp --query" on a Unix socket')
+    parser.add_option('--query', dest='query', metavar='FORMAT',
+                      help='print the current rendering of FORMAT from a \
+running daemon and exit. FORMAT can be "datetime", "clock", \
+"gregdatetime" (or "1", "2" and "3") or an Alp date format')
+    parser.add_option('--socket', dest='socket', metavar='PATH',
+                      help='use PATH as the daemon socket (default is %s)'
+                      % _default_socket_path())
+    parser.add_option('--publish', dest='publish', metavar='PATH',
+                      help='when running continously or as a daemon, \
+publish every Alp second to the memory-mapped file PATH')
+    parser.add_option('--wall', dest='wall', metavar='DATE[@SPEED]',
+                      action='append',
+                      help='show a wall of clocks instead, adding a clock \
+starting at DATE (in the date format below, or "now") with an optional \
+speed. This setting can be specified more than once')
+    parser.add_option('--columns', dest='columns', metavar='N',
+                      type='int', default=4,
+                      help='the number of clocks in each row of a wall \
+(default is 4)')
+    parser.add_option('--search', dest='search', metavar='FILE',
+                      help='print the lines (or, for binary timestamp \
+files, the timestamps) of the sorted FILE in the range of the Alp units \
+of the date (e.g. "ALP:2403,9" for hexalp 9 of alp 2403)')
+    parser.add_option('--build-index', dest='build_index', metavar='FILE',
+                      help='write a sidecar index for searches in the \
+sorted text file FILE')
     parser.add_option('--debug-speed', dest='debug_speed',
                       metavar='SPEED', type='int',
                       help='change the speed (default is 1; setting it to \
@@ -713,16 +2002,53 @@ a higher value makes it go faster).')
 
     options, args = parser.parse_args()
 
+    if options.query is not None:
+        sys.exit(_query_command(options.query, options.socket))
+
+    if options.build_index is not None:
+        try:
+            AlpLogSearcher(options.build_index,
+                           use_index=False).build_index()
+        except (IOError, OSError), e:
+            sys.stderr.write('alp: %s\n' % e)
+            sys.exit(1)
+        sys.exit()
+
+    if options.search is not None:
+        try:
+            typ, units = args[0].lower().split(':')
+            if typ != 'alp':
+                raise ValueError()
+            units = units.split(',')
+        except (IndexError, ValueError):
+            parser.error('--search needs an Alp date such as ALP:2403,9')
+        try:
+            start, end = alp_range(*units)
+        except (TypeError, ValueError, OverflowError), e:
+            parser.error('invalid Alp date for --search: %s' % e)
+        try:
+            for x in search(options.search, start, end):
+                if isinstance(x, datetime):
+                    x = '%04d-%02d-%02d %02d:%02d:%02d\n' % (
+                        x.year, x.month, x.day, x.hour, x.minute, x.second)
+                try:
+                    sys.stdout.write(x)
+                except IOError, e:
+                    if e.errno != errno.EPIPE:
+                        raise
+                    # The reader (e.g. head) has stopped reading
+                    os._exit(0)
+        except (IOError, OSError), e:
+            sys.stderr.write('alp: %s\n' % e)
+            sys.exit(1)
+        sys.exit()
+
     try:
-        date = args[0].lower().split(':')
-        typ = date[0]
-        date = date[1].split(',')
-        if typ == 'alp':
-            date = alp_to_datetime(*date)
-        elif typ == 'gre':
-            date = datetime(*map(int, date))
+        date = _parse_date_arg(args[0])
     except IndexError:
         date = datetime.utcnow()
+    except ValueError, e:
+        parser.error(str(e))
 
     if options.show is None:
         options.show = ['datetime']
@@ -746,13 +2072,64 @@ a higher value makes it go faster).')
     except ImportError:
         pass
 
+    publisher = None
+    if options.publish is not None:
+        if options.wall or not (options.continous or options.daemon):
+            parser.error('--publish needs -c or --daemon, and does not '
+                         'work with --wall')
+        try:
+            publisher = TickPublisher(options.publish)
+        except (IOError, OSError), e:
+            sys.stderr.write('alp: %s\n' % e)
+            sys.exit(1)
+
+    if options.daemon:
+        import signal
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+        set_start_date(date)
+        try:
+            serve(options.socket, publisher)
+        except KeyboardInterrupt:
+            pass
+        except (socket.error, OSError), e:
+            sys.stderr.write('alp: %s\n' % e)
+            sys.exit(1)
+        sys.exit()
+
     start_formatter(options.use_curses)
     set_start_date(date)
 
+    if options.wall:
+        if options.columns < 1:
+            parser.error('--columns must be at least 1')
+        configs = []
+        for spec in options.wall:
+            spec, sep, speed = spec.partition('@')
+            try:
+                config = {'speed': int(speed or 1)}
+            except ValueError:
+                parser.error('invalid wall speed "%s"' % speed)
+            if spec.lower() != 'now':
+                try:
+                    config['start_date'] = _parse_date_arg(spec)
+                except (IndexError, ValueError):
+                    parser.error('invalid wall date "%s"' % spec)
+            configs.append(config)
+        wall = ClockWall(configs, show=options.show,
+                         columns=options.columns)
+        try:
+            print_wall(wall, formatting=options.formatting,
+                       continous=options.continous)
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            formatter._end()
+        sys.exit()
+
     try:
         print_time(date=date, show=options.show,
                    formatting=options.formatting,
-                   continous=options.continous)
+                   continous=options.continous, publisher=publisher)
     except (KeyboardInterrupt, EOFError):
         pass
     finally:
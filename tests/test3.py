@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# Compare the fast paths of the alp module with the reference
+# implementations, using random and boundary timestamps. Mismatches are
+# shrunk and printed as reproducers.
+#
+# Usage: test3.py [iterations] [seed]
+
+import sys
+import os
+import random
+import tempfile
+from datetime import timedelta
+import alp
+
+# Timestamps that datetime objects can hold
+_lowest = alp._get_seconds_from_datetime(alp.datetime(1, 1, 2))
+_highest = alp._get_seconds_from_datetime(alp.datetime(9999, 12, 30))
+_units = ('seconds', 'alp', 'hexalp', 'qvalp', 'salp', 'talp', 'second')
+_unit_sizes = (alp._one_alp, alp._hexalp_divide, alp._qvalp_divide,
+               alp._salp_divide, alp._talp_divide, 1)
+_format_units = ('seconds_since_epoch', 'seconds', 'alp', 'hexalp',
+                 'qvalp', 'salp', 'talp', 'second', 'speed', 'nonexistent')
+
+# AlpTime.update adds the time since epoch to the start date, so start
+# at epoch to be able to update to any date
+alp.set_start_date(alp._epoch)
+alp.set_speed(1)
+
+def _get_date(seconds):
+    return alp._epoch + timedelta(seconds=seconds)
+
+def _get_reference_time(seconds):
+    alp.update(_get_date(seconds))
+    return alp.time
+
+def _run(function, *args):
+    """Get ('ok', result) or ('error', exception type) of a call"""
+    try:
+        return 'ok', function(*args)
+    except Exception, e:
+        return 'error', e.__class__.__name__
+
+######################################################################
+
+# Checks, each taking a timestamp and the extra arguments of the check,
+# and returning None or a (fast, reference) pair of different results
+
+def check_split_seconds(seconds):
+    t = _get_reference_time(seconds)
+    fast = alp.split_seconds(seconds)
+    ref = tuple([getattr(t, x) for x in _units])
+    if alp.time.seconds_since_epoch != seconds:
+        return seconds, alp.time.seconds_since_epoch
+    if fast != ref:
+        return fast, ref
+
+def check_clock(seconds):
+    t = _get_reference_time(seconds)
+    alp.update_clock()
+    ref = alp.get_clock_text()
+    fast = alp._get_compiled_clock_text(
+        alp._compile_clock_layout(alp._default_clock_layout), t)
+    if fast != ref:
+        return fast, ref
+
+def check_date_format(seconds, date_format):
+    t = _get_reference_time(seconds)
+    ref = _run(alp.get_date_text, date_format)
+    fast = _run(alp._get_compiled_date_text,
+                alp._compile_date_format(date_format), t)
+    if fast != ref:
+        return fast, ref
+
+def check_search_key(seconds):
+    t = _get_reference_time(seconds)
+    if not 0 <= t.alp <= 9999:
+        return
+    ref = alp.unformat(alp.get_date_text())
+    fast = alp._get_search_key(_get_date(seconds), 'alp')
+    if fast != ref:
+        return fast, ref
+
+def check_alp_to_datetime(seconds):
+    units = alp.split_seconds(seconds)[1:]
+    as_hex = ['%d' % units[0]] + ['%X' % x for x in units[1:]]
+    ref = alp.alp_to_datetime(*as_hex)
+    fast = _get_date(seconds)
+    if fast != ref or alp.alp_to_datetime(*units) != ref:
+        return fast, ref
+    start, end = alp.alp_range(*as_hex)
+    if (start, end) != (ref, ref + timedelta(seconds=1)):
+        return (start, end), (ref, ref + timedelta(seconds=1))
+
+def check_alp_range(seconds, given):
+    if not _lowest + alp._one_alp <= seconds <= _highest - alp._one_alp:
+        return
+    units = alp.split_seconds(seconds)[1:given + 1]
+    zeroes = [0] * (6 - given)
+    ref_start = alp.alp_to_datetime(*(list(units) + zeroes))
+    ref = ref_start, ref_start + timedelta(seconds=_unit_sizes[given - 1])
+    as_hex = ['%d' % units[0]] + ['%X' % x for x in units[1:]]
+    for args in (units, as_hex):
+        fast = alp.alp_range(*args)
+        if fast != ref:
+            return fast, ref
+    if not ref[0] <= _get_date(seconds) < ref[1]:
+        return _get_date(seconds), ref
+
+def check_stamp_columns(values):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        writer = alp.AlpStampWriter(path, block_size=7)
+        for x in values:
+            writer.write(x)
+        writer.close()
+        reader = alp.AlpStampReader(path)
+        try:
+            columns = reader.columns()
+            dates = reader.datetimes()
+        finally:
+            reader.close()
+    finally:
+        os.unlink(path)
+    if columns['seconds_since_epoch'] != values or \
+            len(dates) != len(values):
+        return columns['seconds_since_epoch'], values
+    for i, x in enumerate(values):
+        t = _get_reference_time(x)
+        fast = tuple([columns[unit][i] for unit in _units]) + (dates[i],)
+        ref = tuple([getattr(t, unit) for unit in _units]) + \
+            (_get_date(x),)
+        if fast != ref:
+            return fast, ref
+
+def _write_stamps(values):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    writer = alp.AlpStampWriter(path, block_size=7)
+    for x in values:
+        writer.write(x)
+    writer.close()
+    return path
+
+def check_stamp_search(values, start, end):
+    path = _write_stamps(values)
+    try:
+        reader = alp.AlpStampReader(path)
+        try:
+            fast = reader.seconds(start, end)
+        finally:
+            reader.close()
+    finally:
+        os.unlink(path)
+    ref = [x for x in values if start <= x < end]
+    if fast != ref:
+        return fast, ref
+
+def _get_log_key(seconds, key_format, i):
+    if key_format == 'alp':
+        _get_reference_time(seconds)
+        return alp.unformat(alp.get_date_text())
+    d = _get_date(seconds)
+    return '%04d-%02d-%02d%s%02d:%02d:%02d' % (
+        d.year, d.month, d.day, ' T'[i % 2], d.hour, d.minute, d.second)
+
+def check_log_search(values, start, end, key_format, use_index):
+    values = sorted(values)
+    if key_format == 'alp':
+        values = [x for x in values if 0 <= x >> 18 <= 9999]
+    entries = []
+    for i, x in enumerate(values):
+        text = '%s event %d\n' % (_get_log_key(x, key_format, i), i)
+        if i % 3 == 0:
+            text += '  continued\n'
+        entries.append((x, text))
+    ref = ''.join([text for x, text in entries if start <= x < end])
+
+    fd, path = tempfile.mkstemp()
+    os.write(fd, ''.join([text for x, text in entries]))
+    os.close(fd)
+    try:
+        searcher = alp.AlpLogSearcher(path, key_format, use_index=False)
+        try:
+            if use_index:
+                searcher.build_index(step=64)
+            fast = ''.join(searcher.lines(_get_date(start), _get_date(end)))
+        finally:
+            searcher.close()
+    finally:
+        os.unlink(path)
+        if os.path.exists(path + '.alpidx'):
+            os.unlink(path + '.alpidx')
+    if fast != ref:
+        return fast, ref
+
+######################################################################
+
+# Shrinking
+
+def _shrink_seconds(seconds):
+    """Get simpler timestamps than seconds, simplest first"""
+    sign = 1
+    if seconds < 0:
+        sign = -1
+    candidates = [0, -1]
+    units = alp.split_seconds(seconds)
+    if units[1] not in (0, -1):
+        candidates.append(seconds - (units[1] - units[1] / 2) * alp._one_alp)
+        candidates.append(seconds - units[1] * alp._one_alp)
+    # Round toward zero, so timestamps before epoch shrink too
+    for size in _unit_sizes:
+        left = abs(seconds) % size
+        if left:
+            candidates.append(seconds - sign * left)
+    candidates.append(sign * (abs(seconds) / 2))
+    candidates.append(seconds - sign)
+    return [x for x in candidates if abs(x) < abs(seconds)]
+
+def _shrink_format(date_format):
+    """Get simpler date formats than date_format"""
+    parts = alp._date_format_unit_regex.split(date_format)
+    candidates = []
+    for i in range(len(parts)):
+        if not parts[i]:
+            continue
+        rest = parts[:i] + [''] + parts[i + 1:]
+        for j in range(1, len(rest), 2):
+            if rest[j]:
+                rest[j] = '&(%s)' % rest[j]
+        candidates.append(''.join(rest))
+    return [x for x in candidates if len(x) < len(date_format)]
+
+def _shrink(check, seconds, extra):
+    changed = True
+    while changed:
+        changed = False
+        for x in _shrink_seconds(seconds):
+            if check(x, *extra) is not None:
+                seconds = x
+                changed = True
+                break
+        if extra and isinstance(extra[0], str):
+            for x in _shrink_format(extra[0]):
+                if check(seconds, x) is not None:
+                    extra = (x,)
+                    changed = True
+                    break
+    return seconds, extra
+
+def _shrink_values(check, values, extra):
+    """Shrink a failing list by bisecting it and shrinking its items"""
+    changed = True
+    while changed:
+        changed = False
+        n = len(values)
+        candidates = [values[:n / 2], values[n / 2:]]
+        candidates.extend([values[:i] + values[i + 1:] for i in range(n)])
+        for x in candidates:
+            if x and len(x) < n and check(x, *extra) is not None:
+                values = x
+                changed = True
+                break
+        if changed:
+            continue
+        for i in range(n):
+            for x in _shrink_seconds(values[i]):
+                smaller = values[:i] + [x] + values[i + 1:]
+                if check(smaller, *extra) is not None:
+                    values = smaller
+                    changed = True
+                    break
+            if changed:
+                break
+    return values
+
+def _print_report(check, args, reported):
+    """Print a mismatch, unless the same one has been printed"""
+    fast, ref = check(*args)
+    reproducer = 'print test3.%s(%s)' % (
+        check.__name__, ', '.join([repr(x) for x in args]))
+    if reproducer in reported:
+        return
+    reported.add(reproducer)
+    print 'MISMATCH in %s' % check.__name__
+    print '  fast:      %r' % (fast,)
+    print '  reference: %r' % (ref,)
+    print '  reproduce: cd tests && python -c "import test3; %s"' % \
+        reproducer
+
+def _report(check, seconds, extra, reported):
+    seconds, extra = _shrink(check, seconds, extra)
+    _print_report(check, (seconds,) + extra, reported)
+
+def _report_values(check, values, extra, reported):
+    values = _shrink_values(check, values, extra)
+    _print_report(check, (values,) + extra, reported)
+
+######################################################################
+
+def _get_boundaries():
+    values = []
+    for size in (alp._one_alp,) + _unit_sizes:
+        for k in range(-3, 4):
+            values.extend([k * size - 1, k * size, k * size + 1])
+    values.extend([_lowest, _highest])
+    return values
+
+def _get_random_seconds(rand):
+    kind = rand.random()
+    if kind < 0.4:
+        return rand.randint(_lowest, _highest)
+    elif kind < 0.8:
+        return rand.randint(-2 ** 30, 2 ** 30)
+    size = rand.choice(_unit_sizes)
+    return rand.randint(_lowest / size + 1, _highest / size - 1) * size + \
+        rand.randint(-1, 1)
+
+def _get_random_format(rand):
+    parts = []
+    for i in range(rand.randint(0, 5)):
+        unit = rand.choice(_format_units)
+        kind = rand.random()
+        if kind < 0.3:
+            unit += '#'
+        elif kind < 0.6:
+            unit += '_' + rand.choice(['1', '4', '8', '4#', ''])
+        parts.append(rand.choice(['', 'ALP', '/', ' ', '!(bold)', '&']))
+        parts.append('&(%s)' % unit)
+    return ''.join(parts)
+
+def main(iterations=2000, seed=None):
+    rand = random.Random(seed)
+    mismatches = 0
+    reported = set()
+    cases = []
+    for x in _get_boundaries():
+        cases.append(x)
+    for i in range(iterations):
+        cases.append(_get_random_seconds(rand))
+
+    checks = [check_split_seconds, check_clock, check_search_key,
+              check_alp_to_datetime]
+    for x in cases:
+        extras = [(check, ()) for check in checks]
+        extras.append((check_date_format, (alp._default_hex_date_format,)))
+        extras.append((check_date_format, (_get_random_format(rand),)))
+        extras.append((check_alp_range, (rand.randint(1, 5),)))
+        for check, extra in extras:
+            if check(x, *extra) is not None:
+                mismatches += 1
+                _report(check, x, extra, reported)
+
+    for i in range(0, len(cases), 50):
+        values = cases[i:i + 50]
+        if i % 100:
+            # Clustered timestamps, with equal neighbours
+            x = values[0]
+            values = []
+            for j in range(50):
+                x += rand.choice([0, 0, 1, 2, 15, 300])
+                values.append(x)
+        bounds = [rand.choice(values) + rand.randint(-1, 1)
+                  for j in range(2)]
+        start, end = min(bounds), max(bounds) + rand.randint(0, 1)
+        value_checks = [
+            (check_stamp_columns, ()),
+            (check_stamp_search, (start, end)),
+            (check_log_search, (start, end, 'gre', False)),
+            (check_log_search, (start, end, 'gre', True)),
+            (check_log_search, (start, end, 'alp', False)),
+            (check_log_search, (start, end, 'alp', True))
+        ]
+        for values in (values, sorted(values)):
+            for check, extra in value_checks:
+                if check(values, *extra) is not None:
+                    mismatches += 1
+                    _report_values(check, values, extra, reported)
+
+    print '%d timestamps, %d mismatches (%d distinct)' % (
+        len(cases), mismatches, len(reported))
+    return mismatches == 0
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    iterations = 2000
+    seed = None
+    if args:
+        iterations = int(args[0])
+    if len(args) > 1:
+        seed = int(args[1])
+    if not main(iterations, seed):
+        sys.exit(1)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# Publish the Alp time in a tick file and read it back
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+import alp
+
+directory = tempfile.mkdtemp()
+try:
+    path = os.path.join(directory, 'tick')
+    publisher = alp.TickPublisher(path)
+    reader = alp.TickReader(path)
+    assert reader.read() is None
+
+    for date in (datetime(2010, 10, 15, 12, 0, 0),
+                 datetime(2010, 10, 15, 11, 59, 59),
+                 datetime(1990, 1, 1, 0, 0, 0),
+                 datetime(2403, 5, 6, 7, 8, 9)):
+        alp.set_start_date(date)
+        publisher.publish()
+        tick = reader.read()
+        for unit in alp._time_units:
+            assert tick[unit] == getattr(alp.time, unit), unit
+        assert tick['text'] == alp.unformat(alp.get_date_text())
+        print tick['seconds_since_epoch'], tick['text']
+    assert tick['seconds_since_epoch'] > 0
+    alp.set_start_date(datetime(1990, 1, 1))
+    publisher.publish()
+    assert reader.read()['seconds_since_epoch'] < 0
+
+    publisher.close()
+    reader.close()
+finally:
+    shutil.rmtree(directory)
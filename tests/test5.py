@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Drive an AlpScheduler with a fake clock before epoch
+
+from datetime import timedelta
+import alp
+
+class FakeTime(alp.AlpTime):
+    """An Alp time whose real clock only moves when told to"""
+    elapsed = 0
+
+    def get_seconds_since_epoch(self, date=None):
+        if date is None:
+            date = self.start_date + timedelta(seconds=self.elapsed)
+        return alp.AlpTime.get_seconds_since_epoch(self, date)
+
+fake = FakeTime()
+fake.set_start_date(alp._epoch - timedelta(seconds=1000))
+fake.set_speed(4)
+scheduler = alp.AlpScheduler(fake)
+fired = []
+
+def run(elapsed):
+    fake.elapsed = elapsed
+    del fired[:]
+    return scheduler.run_pending()
+
+# The first talp boundary after -1000 is -992
+talps = scheduler.every('talp', fired.append, 'talp')
+# (-1, 15, 3, 12, 1, 8) is -1000, so this is -988
+once = scheduler.at((-1, 15, 3, 12, 2, 4), fired.append, 'at')
+assert run(0) == 8 and fired == []
+assert run(1.75) == 1 and fired == []
+assert run(2) == 4 and fired == ['talp']
+assert run(3) == 12 and fired == ['at']
+assert once.due == -988
+
+# At speed 4, every real second is 4 Alp seconds
+assert run(5.5) == 2 and fired == []
+assert run(6) == 16 and fired == ['talp']
+assert talps.due == -960
+
+# A late timer fires once and skips to the next boundary after now
+assert run(25) == 4 and fired == ['talp']
+assert talps.due == -896
+
+# Cancelled timers never fire and are dropped from the scheduler
+hexalps = scheduler.every('hexalp', fired.append, 'hexalp')
+assert hexalps.due == 0
+talps.cancel()
+assert run(26) == 896 and fired == []
+assert run(250) == 16384 and fired == ['hexalp']
+hexalps.cancel()
+assert run(5000) is None and fired == []
+print 'ok'